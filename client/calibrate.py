@@ -0,0 +1,244 @@
+"""
+Ball Bounce Detector Calibration
+
+This module tunes the parameters of the client's detector (cv2.HoughCircles) against
+ground truth. It connects to the server like a client, records the frames generated
+by `BallBounce` together with the true ball positions the server replies with, and
+then sweeps the detector parameters over the recorded frames. The most accurate
+parameters within a target latency per frame are saved for `client.py --params`.
+
+Attributes:
+    GRID (dict): Values swept for each cv2.HoughCircles parameter. `radius` holds
+        (minRadius, maxRadius) pairs, where 0 means no bound.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+
+import cv2
+import numpy as np
+
+try:
+    from client.client import HOUGH_PARAMS, consume_signaling, detect_ball, load_aiortc
+except ImportError: # Run as a script next to client.py, e.g. in the client image.
+    from client import HOUGH_PARAMS, consume_signaling, detect_ball, load_aiortc
+
+GRID = {
+    'dp': [1, 2, 3, 5],
+    'minDist': [10, 100],
+    'param1': [50, 100, 150],
+    'param2': [10, 20, 40, 100],
+    'radius': [(0, 0), (10, 40)],
+}
+
+
+async def collect(host: str, port: int, n: int,
+                  timeout: float=5) -> list[tuple[np.ndarray, tuple[int, int]]]:
+    """
+    Records frames from the server together with the true position of the ball.
+
+    Every received frame is answered with a probe, a result the server replies to
+    with the ball position it recorded for that pts without logging it as a score.
+
+    Args:
+        host (str): Host of the server's signaling.
+        port (int): Port of the server's signaling.
+        n (int): Number of frames to receive.
+        timeout (float, optional): Seconds to wait for the track and for each frame.
+            Defaults to 5.
+
+    Returns:
+        list[tuple[np.ndarray, tuple[int, int]]]: The BGR frames with the ball's center,
+            for the frames the server could score.
+
+    Raises:
+        TimeoutError: If the server stops sending frames.
+    """
+    aiortc = load_aiortc()
+    signaling = aiortc.contrib.signaling.TcpSocketSignaling(host, port)
+    pc = aiortc.RTCPeerConnection()
+    peer = dict()
+    frames, truth = dict(), dict()
+
+    def on_reply(message: str):
+        reply = json.loads(message)
+        if 'xy' in reply:
+            truth[reply['pts']] = tuple(reply['xy'])
+
+    @pc.on("datachannel")
+    def on_datachannel(channel: aiortc.RTCDataChannel):
+        channel.add_listener("message", on_reply)
+        peer['channel'] = channel
+
+    @pc.on("track")
+    def on_track(track: aiortc.VideoStreamTrack):
+        peer['track'] = track
+
+    try:
+        await signaling.connect()
+        while 'track' not in peer:
+            if not await asyncio.wait_for(consume_signaling(pc, signaling), timeout):
+                raise ConnectionError("Signaling ended before receiving a track")
+        while len(frames) < n:
+            frame = await asyncio.wait_for(peer['track'].recv(), timeout)
+            frames[frame.pts] = cv2.cvtColor(frame.to_ndarray(), cv2.COLOR_YUV2BGR_I420)
+            channel = peer.get('channel')
+            if channel is not None and channel.readyState == "open":
+                channel.send(json.dumps({'pts': frame.pts, 'x': 0, 'y': 0, 'probe': True}))
+        # Let the replies to the last results arrive.
+        await asyncio.sleep(1)
+    finally:
+        await pc.close()
+        await signaling.close()
+    return [(frames[pts], xy) for pts, xy in truth.items() if pts in frames]
+
+
+def evaluate(samples: list[tuple[np.ndarray, tuple[int, int]]], params: dict,
+             miss_penalty: float=50) -> dict:
+    """
+    Runs the detector with the given parameters over the samples.
+
+    Args:
+        samples (list): The BGR frames with the ball's center, as returned by `collect`.
+        params (dict): Keyword arguments of cv2.HoughCircles.
+        miss_penalty (float, optional): Error in pixels counted for a frame where no
+            ball is detected. Defaults to 50.
+
+    Returns:
+        dict: The `params` with the mean `latency_ms` per frame, the mean `error_px`
+            and the ratio of `detected` frames.
+    """
+    start = time.perf_counter()
+    centers = [detect_ball(frame, params) for frame, _ in samples]
+    latency = (time.perf_counter() - start) / len(samples)
+    errors = [
+        miss_penalty if center is None else np.hypot(center[0] - x, center[1] - y)
+        for center, (_, (x, y)) in zip(centers, samples)
+    ]
+    return {
+        'params': params,
+        'latency_ms': latency * 1000,
+        'error_px': float(np.mean(errors)),
+        'detected': sum(center is not None for center in centers) / len(samples),
+    }
+
+
+def sweep(samples: list[tuple[np.ndarray, tuple[int, int]]], grid: dict=GRID,
+          miss_penalty: float=50) -> list[dict]:
+    """
+    Evaluates every combination of the parameters in the grid.
+
+    Args:
+        samples (list): The BGR frames with the ball's center, as returned by `collect`.
+        grid (dict, optional): Values to sweep for each parameter. Defaults to `GRID`.
+        miss_penalty (float, optional): See `evaluate`.
+
+    Returns:
+        list[dict]: The evaluations, as returned by `evaluate`.
+    """
+    evaluations = []
+    for dp, min_dist, param1, param2, (min_r, max_r) in itertools.product(
+            grid['dp'], grid['minDist'], grid['param1'], grid['param2'], grid['radius']):
+        params = {'dp': dp, 'minDist': min_dist, 'param1': param1, 'param2': param2,
+                  'minRadius': min_r, 'maxRadius': max_r}
+        evaluations.append(evaluate(samples, params, miss_penalty))
+    return evaluations
+
+
+def pareto_front(evaluations: list[dict]) -> list[dict]:
+    """
+    Keeps the evaluations that no faster evaluation beats in accuracy.
+
+    Args:
+        evaluations (list[dict]): The evaluations, as returned by `evaluate`.
+
+    Returns:
+        list[dict]: The speed/accuracy curve, fastest first.
+    """
+    front = []
+    for evaluation in sorted(evaluations, key=lambda e: (e['latency_ms'], e['error_px'])):
+        if not front or evaluation['error_px'] < front[-1]['error_px']:
+            front.append(evaluation)
+    return front
+
+
+def select(evaluations: list[dict], target_latency: float) -> dict|None:
+    """
+    Picks the most accurate evaluation within the target latency.
+
+    Evaluations that never detected the ball are never picked.
+
+    Args:
+        evaluations (list[dict]): The evaluations, as returned by `evaluate`.
+        target_latency (float): Target latency per frame in milliseconds.
+
+    Returns:
+        dict|None: The most accurate evaluation within the target, or the fastest one
+            if none is within the target, or None if no evaluation detected the ball.
+    """
+    detecting = [e for e in evaluations if e['detected'] > 0]
+    if not detecting:
+        return None
+    within = [e for e in detecting if e['latency_ms'] <= target_latency]
+    if not within:
+        return min(detecting, key=lambda e: e['latency_ms'])
+    return min(within, key=lambda e: (e['error_px'], e['latency_ms']))
+
+
+def describe(evaluation: dict) -> str:
+    """Formats an evaluation on one line."""
+    return (f"{evaluation['latency_ms']:6.2f} ms {evaluation['error_px']:7.2f} px "
+            f"{evaluation['detected']:6.1%} detected  {evaluation['params']}")
+
+
+if __name__ == "__main__":
+    """
+    Parses command-line arguments, records frames from the server, sweeps the detector
+    parameters and saves the best ones for the target latency.
+    """
+    parser = argparse.ArgumentParser(description="Ball bounce detector calibration")
+    parser.add_argument("--host", default="0.0.0.0", help="Host for HTTP server (default: 0.0.0.0)")
+    parser.add_argument("--port", type=int, default=8080, help="Port for HTTP server (default: 8080)")
+    parser.add_argument("--frames", type=int, default=60, help="Frames to record (default: 60)")
+    parser.add_argument("--timeout", type=float, default=5,
+                        help="Seconds to wait for the server's track and each frame (default: 5)")
+    parser.add_argument("--target-latency", type=float, default=20,
+                        help="Target detection latency per frame in ms (default: 20)")
+    parser.add_argument("--miss-penalty", type=float, default=50,
+                        help="Error in pixels counted for a missed ball (default: 50)")
+    parser.add_argument("--output", default="hough.json",
+                        help="Where to save the parameters for client.py --params (default: hough.json)")
+    parser.add_argument("--verbose", "-v", action="count")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.WARNING)
+
+    try:
+        samples = asyncio.run(collect(args.host, args.port, args.frames, args.timeout))
+    except TimeoutError:
+        raise SystemExit(f"The server sent no frame for {args.timeout} s")
+    if not samples:
+        raise SystemExit("No frame could be scored by the server")
+    print(f"Recorded {len(samples)} frames with ground truth")
+
+    evaluations = sweep(samples, miss_penalty=args.miss_penalty)
+    print("Speed/accuracy curve:")
+    for evaluation in pareto_front(evaluations):
+        print("  " + describe(evaluation))
+    print("Built-in: " + describe(evaluate(samples, HOUGH_PARAMS, args.miss_penalty)))
+
+    best = select(evaluations, args.target_latency)
+    if best is None:
+        raise SystemExit(f"No parameters detected the ball, {args.output} left unchanged")
+    if best['latency_ms'] > args.target_latency:
+        print(f"No parameters within {args.target_latency} ms, falling back to the fastest")
+    print("Selected: " + describe(best))
+    with open(args.output, "w") as f:
+        json.dump({**best, 'target_latency_ms': args.target_latency}, f, indent=2)
+    print(f"Saved to {args.output}")
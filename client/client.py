@@ -4,65 +4,326 @@ Ball Bounce Client
 This module provides a client for the Ball Bounce demo, which detects the position
 of a ball in a video stream using OpenCV and communicates the results using aiortc.
 
+aiortc and av are only imported once the detector process is started, and HighGUI
+is only touched with `--display`, so the client also starts on headless pods.
+
 Attributes:
     CV_DP (int): Inverse ratio of the accumulator resolution to the image resolution.
     CV_MINDIST (int): Minimum distance between the centers of the detected circles.
+    HOUGH_PARAMS (dict): Default parameters of cv2.HoughCircles, see `calibrate.py`
+        to tune them and `--params` to load the tuned ones.
+    FRAME_QUEUE_SIZE (int): Frames waiting for the detector at most, see `submit_frame`.
+    STARTED (float): Monotonic time at which the module started loading, before any
+        other import, the origin of the startup measurements.
 """
+from __future__ import annotations
+
+import time
+
+STARTED = time.monotonic()
+
 import argparse
 import asyncio
-import ctypes
+import functools
 import json
 import logging
+import multiprocessing
+import os
+import queue
+import sys
+from typing import TYPE_CHECKING
+
 import cv2
 import numpy as np
 
-"""
-HACK: It's necessary to run cv2.imshow once before importing VideoFrame and aiortc when deploying on Docker
-"""
-cv2.imshow("client", np.zeros((50, 50, 3)))
-
-import aiortc
-import multiprocessing
-from av import VideoFrame
-from aiortc.contrib.signaling import BYE, TcpSocketSignaling
+if TYPE_CHECKING:
+    import aiortc
+    from aiortc.contrib.signaling import TcpSocketSignaling
 
 # CV_DP: Inverse ratio of the accumulator resolution to the image resolution.
 CV_DP = 5
 # CV_MINDIST: Minimum distance between the centers of the detected circles.
 CV_MINDIST = 10
+HOUGH_PARAMS = {'dp': CV_DP, 'minDist': CV_MINDIST}
+# FRAME_QUEUE_SIZE: Frames waiting for the detector at most, older ones are skipped.
+FRAME_QUEUE_SIZE = 2
 
 logger = logging.Logger("client")
 
-def process_a(frame_queue: multiprocessing.Queue, ball_x, ball_y, timestamp):
+startup_events = set()
+def log_startup(event: str):
+    """
+    Logs, once per process, how long after `STARTED` a startup event happened.
+
+    Args:
+        event (str): Name of the event, e.g. "first frame".
+    """
+    if event in startup_events:
+        return
+    startup_events.add(event)
+    logger.warning(f"Startup: {event} after {(time.monotonic() - STARTED) * 1000:.0f} ms")
+
+
+@functools.cache
+def load_aiortc():
+    """
+    Imports aiortc and av, the heaviest part of the startup.
+
+    The import time is only logged when this actually imports them, not when e.g.
+    `swarm.py` already did.
+
+    Returns:
+        module: The `aiortc` module, with `aiortc.contrib.signaling` loaded.
+    """
+    loaded = 'aiortc' in sys.modules
+    start = time.monotonic()
+    import aiortc
+    import aiortc.contrib.signaling
+    if not loaded:
+        logger.warning(f"Startup: media stack imported in {(time.monotonic() - start) * 1000:.0f} ms")
+    return aiortc
+
+
+def load_params(path: str) -> dict:
+    """
+    Loads the cv2.HoughCircles parameters saved by `calibrate.py`.
+
+    Args:
+        path (str): Path of the JSON file.
+
+    Returns:
+        dict: The parameters, completed with the defaults of `HOUGH_PARAMS`.
+    """
+    with open(path) as f:
+        return {**HOUGH_PARAMS, **json.load(f)['params']}
+
+
+def detect_ball(frame: np.ndarray, params: dict=HOUGH_PARAMS) -> tuple[int, int]|None:
+    """
+    Locates the ball in a BGR frame with the Hough Circle Transformation in OpenCV.
+
+    Args:
+        frame (np.ndarray): The BGR video frame.
+        params (dict, optional): Keyword arguments of cv2.HoughCircles, e.g. `dp`,
+            `minDist`, `param1`, `param2`, `minRadius` and `maxRadius`.
+            Defaults to `HOUGH_PARAMS`.
+
+    Returns:
+        tuple[int, int]|None: The center of the first detected circle, or None.
+    """
+    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    circles = cv2.HoughCircles(frame, cv2.HOUGH_GRADIENT, **params)
+    if circles is None:
+        return None
+    return circles[0][0][0], circles[0][0][1]
+
+
+def track_ball(detected: tuple|None, velocity: tuple[float, float], t: int,
+               center: tuple|None, size: tuple[int, int]) -> tuple:
     """
-    Processes a video frame to locate a ball, and then updates its position.
+    Updates the tracked ball with the detection on the frame of pts `t`.
 
-    The function uses the Hough Circle Transformation method in OpenCV to detect the 
-    circle representing the ball and calculates the difference in the position of the
-    ball to update its coordinates.
+    The velocity is only measured between two real detections, so that a wrong
+    prediction never feeds back into it. When the ball is not detected, its position
+    is predicted from the last detection along the velocity, inside the frame.
 
     Args:
-        frame_queue (multiprocessing.Queue): Queue storing the video frames.
-        ball_x (multiprocessing.Value): X-coordinate of the ball's center.
-        ball_y (multiprocessing.Value): Y-coordinate of the ball's center.
-        timestamp (multiprocessing.Value): Timestamp of the current frame.
+        detected (tuple|None): The last detection (pts, x, y), or None before the first.
+        velocity (tuple[float, float]): The velocity in pixels per pts unit.
+        t (int): The pts of the processed frame.
+        center (tuple|None): The ball's center detected on the frame, or None.
+        size (tuple[int, int]): The width and height of the frame.
+
+    Returns:
+        tuple: The updated `detected` and `velocity`, and the (pts, x, y, vx, vy) result
+            for the frame, or None until the ball has been detected once.
     """
-    x_diff, y_diff = 0, 0
+    if center is not None:
+        if detected is not None and t > detected[0]:
+            dt = t - detected[0]
+            velocity = ((center[0] - detected[1]) / dt, (center[1] - detected[2]) / dt)
+        detected = (t, center[0], center[1])
+    if detected is None:
+        return detected, velocity, None
+    dt = t - detected[0]
+    x = np.clip(detected[1] + velocity[0] * dt, 0, size[0] - 1)
+    y = np.clip(detected[2] + velocity[1] * dt, 0, size[1] - 1)
+    return detected, velocity, (t, int(x), int(y), *velocity)
+
+
+def process_a(frame_queue: multiprocessing.Queue, result_queue: multiprocessing.Queue,
+              detect=detect_ball):
+    """
+    Processes the video frames to locate the ball, and reports its position per frame.
+
+    The function uses the `detect` function (by default the Hough Circle Transformation
+    method in OpenCV) to detect the circle representing the ball, and `track_ball` to
+    track its velocity and predict its position when it is not detected.
+
+    Args:
+        frame_queue (multiprocessing.Queue): Queue storing the (pts, frame) to process.
+        result_queue (multiprocessing.Queue): Queue receiving one (pts, x, y, vx, vy)
+            result per processed frame once the ball has been detected, with the
+            velocity in pixels per pts unit.
+        detect (callable, optional): Maps a BGR frame to the ball's center or None.
+            Defaults to `detect_ball`.
+    """
+    detected, velocity = None, (0.0, 0.0)
     while True:
         (t, frame) = frame_queue.get()
         if frame is None:
             continue
         # Process the frame with OpenCV to locate the ball and update ball_location
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        circles = cv2.HoughCircles(frame, cv2.HOUGH_GRADIENT, dp=CV_DP, minDist=CV_MINDIST)
+        center = detect(frame)
+        detected, velocity, result = track_ball(detected, velocity, t, center, frame.shape[1::-1])
+        if result is not None:
+            result_queue.put(result)
+
 
-        with timestamp.get_lock() and ball_x.get_lock() and ball_y.get_lock():
-            if circles is not None:
-                x_diff = circles[0][0][0] - ball_x.value
-                y_diff = circles[0][0][1] - ball_y.value
-            timestamp.value = t
-            ball_x.value += int(x_diff)
-            ball_y.value += int(y_diff)
+def start_detector(detect=detect_ball):
+    """
+    Starts a daemon process running `process_a` and returns its queues.
+
+    The process is spawned rather than forked, since it is started from a running
+    event loop whose threads (e.g. the queue feeders of other detectors) could hold
+    locks that a forked child would inherit.
+
+    Args:
+        detect (callable, optional): Detection function run by the process.
+
+    Returns:
+        tuple: The process, its frame queue and its result queue.
+    """
+    context = multiprocessing.get_context("spawn")
+    frame_queue = context.Queue(FRAME_QUEUE_SIZE) # Queues are thread and process safe.
+    result_queue = context.Queue()
+    process = context.Process(
+        target=process_a, 
+        args=(frame_queue, result_queue, detect),
+        daemon=True,
+    )
+    process.start()
+    return process, frame_queue, result_queue
+
+
+def stop_detector(process: multiprocessing.Process, frame_queue: multiprocessing.Queue,
+                  result_queue: multiprocessing.Queue):
+    """
+    Stops a detector started by `start_detector` and releases its queues.
+
+    The frames still buffered for the killed process are discarded, otherwise the
+    queue's feeder thread blocks the interpreter's exit writing them to the pipe.
+
+    Args:
+        process (multiprocessing.Process): The detector process.
+        frame_queue (multiprocessing.Queue): Its frame queue.
+        result_queue (multiprocessing.Queue): Its result queue.
+    """
+    process.terminate()
+    for q in (frame_queue, result_queue):
+        q.cancel_join_thread()
+        q.close()
+
+
+def submit_frame(frame_queue: multiprocessing.Queue, pts: int, frame: np.ndarray) -> bool:
+    """
+    Queues a frame for the detector without waiting, skipping the oldest one if full.
+
+    A detector slower than the stream thus works on the newest frames instead of
+    piling up a backlog.
+
+    Args:
+        frame_queue (multiprocessing.Queue): The detector's frame queue.
+        pts (int): The pts of the frame.
+        frame (np.ndarray): The BGR frame.
+
+    Returns:
+        bool: True if a queued frame had to be skipped.
+    """
+    skipped = False
+    while True:
+        try:
+            frame_queue.put_nowait((pts, frame))
+            return skipped
+        except queue.Full:
+            try:
+                frame_queue.get_nowait()
+                skipped = True
+            except queue.Empty: # The detector just took it.
+                pass
+
+
+def drain_results(result_queue: multiprocessing.Queue) -> list[tuple]:
+    """
+    Takes all the results the detector has produced so far, without waiting.
+
+    Args:
+        result_queue (multiprocessing.Queue): The detector's result queue.
+
+    Returns:
+        list[tuple]: The (pts, x, y, vx, vy) results, oldest first.
+    """
+    results = []
+    while True:
+        try:
+            results.append(result_queue.get_nowait())
+        except queue.Empty:
+            return results
+
+
+class ResultReporter():
+    """
+    Turns the detector's results into the messages sent to the server.
+
+    By default every result is reported once, with the pts of the frame it was
+    computed on. With `extrapolate`, one message is reported per received frame
+    instead: the latest result moved forward to the frame's pts along the tracked
+    velocity. Either way each message tells in `stale` how many seconds the
+    underlying detection lags behind the newest received frame.
+
+    Attributes:
+        extrapolate (bool): Report positions extrapolated to the newest pts.
+        last (tuple|None): The latest (pts, x, y, vx, vy) result.
+    """
+    def __init__(self, extrapolate: bool=False):
+        """
+        Initializes the ResultReporter without any result yet.
+
+        Args:
+            extrapolate (bool, optional): Report positions extrapolated to the newest
+                pts. Defaults to False.
+        """
+        self.extrapolate = extrapolate
+        self.last = None
+
+    def report(self, results: list[tuple], frame) -> list[dict]:
+        """
+        Composes the messages for the new results, as of the newest received frame.
+
+        Args:
+            results (list[tuple]): The new (pts, x, y, vx, vy) results, oldest first.
+            frame (VideoFrame): The newest received frame.
+
+        Returns:
+            list[dict]: The messages with `pts`, `x`, `y` and `stale`.
+        """
+        if results:
+            self.last = results[-1]
+        if not self.extrapolate:
+            return [
+                {'pts': t, 'x': x, 'y': y, 'stale': float((frame.pts - t) * frame.time_base)}
+                for (t, x, y, _, _) in results
+            ]
+        if self.last is None:
+            return []
+        (t, x, y, vx, vy) = self.last
+        dt = frame.pts - t
+        return [{
+            'pts': frame.pts,
+            'x': int(np.clip(x + vx * dt, 0, frame.width - 1)),
+            'y': int(np.clip(y + vy * dt, 0, frame.height - 1)),
+            'stale': float(dt * frame.time_base),
+        }]
 
 
 async def consume_signaling(
@@ -77,9 +338,16 @@ async def consume_signaling(
         signaling (TcpSocketSignaling): The signaling instance.
 
     Returns:
-        bool: False if a BYE message is received, indicating that the session should be terminated.
+        bool: False if a BYE message is received or the signaling connection is closed,
+            indicating that the session should be terminated.
     """
+    aiortc = load_aiortc()
+    BYE = aiortc.contrib.signaling.BYE
+
     obj = await signaling.receive()
+    if obj is None:
+        logger.debug("Signaling connection closed")
+        return False
     if obj is BYE:
         logger.debug("Exiting")
         await signaling.close()
@@ -100,16 +368,33 @@ async def consume_signaling(
 
 pc_channel: aiortc.RTCDataChannel|None = None
 pc_track: aiortc.VideoStreamTrack|None = None
-async def run_answer():
+async def run_answer(host: str, port: int, display: bool=False, extrapolate: bool=False,
+                     params: dict=HOUGH_PARAMS):
     """
     Initializes the RTC peer connection, establishes the data channel and track handlers, 
     and processes the video stream to detect the position of the ball.
 
     The function sets up signaling, data channel, and track event handlers, starts a
     separate process to handle OpenCV frame processing, and continuously receives and
-    processes video frames.
+    processes video frames. The detector process is started first, so that it gets
+    ready while aiortc is imported.
+
+    Args:
+        host (str): Host of the server's signaling.
+        port (int): Port of the server's signaling.
+        display (bool, optional): Show the received frames in a HighGUI window.
+            Defaults to False.
+        extrapolate (bool, optional): Report the latest position extrapolated to each
+            received frame instead of each result with its own pts (see `ResultReporter`).
+            Defaults to False.
+        params (dict, optional): Parameters of cv2.HoughCircles for the detector.
+            Defaults to `HOUGH_PARAMS`.
     """
-    signaling = TcpSocketSignaling(args.host, args.port)
+    _, frame_queue, result_queue = start_detector(functools.partial(detect_ball, params=params))
+    reporter = ResultReporter(extrapolate)
+
+    aiortc = load_aiortc()
+    signaling = aiortc.contrib.signaling.TcpSocketSignaling(host, port)
     pc = aiortc.RTCPeerConnection()
     await signaling.connect()
 
@@ -131,30 +416,19 @@ async def run_answer():
             await signaling.close()
             pcs.discard(pc)
 
-    frame_queue = multiprocessing.Queue() # Queues are thread and process safe.
-    ball_x = multiprocessing.Value(ctypes.c_int, 0)
-    ball_y = multiprocessing.Value(ctypes.c_int, 0)
-    timestamp = multiprocessing.Value(ctypes.c_int, 0)
-    multiprocessing.Process(
-        target=process_a, 
-        args=(frame_queue, ball_x, ball_y, timestamp),
-        daemon=True,
-    ).start()
-
     while await consume_signaling(pc, signaling):
         while pc_track:
             frame = await pc_track.recv()
+            log_startup("first frame")
             cv_frame = cv2.cvtColor(frame.to_ndarray(), cv2.COLOR_YUV2BGR_I420)
-            frame_queue.put((frame.pts, cv_frame))
-            cv2.imshow('client', cv_frame)
-            cv2.waitKey(10)
+            submit_frame(frame_queue, frame.pts, cv_frame)
+            if display:
+                cv2.imshow('client', cv_frame)
+                cv2.waitKey(10)
+            messages = reporter.report(drain_results(result_queue), frame)
             if pc_channel:
-                data: str = json.dumps({
-                    'pts': timestamp.value,
-                    'x': ball_x.value,
-                    'y': ball_y.value,
-                })
-                pc_channel.send(data)
+                for message in messages:
+                    pc_channel.send(json.dumps(message))
 
 
 pcs = set() 
@@ -177,6 +451,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ball bounce client demo")
     parser.add_argument("--host", default="0.0.0.0", help="Host for HTTP server (default: 0.0.0.0)")
     parser.add_argument("--port", type=int, default=8080, help="Port for HTTP server (default: 8080)")
+    parser.add_argument("--display", action=argparse.BooleanOptionalAction,
+                        default=bool(os.environ.get("DISPLAY")),
+                        help="Show the received frames in a window (default: if $DISPLAY is set)")
+    parser.add_argument("--extrapolate", action="store_true",
+                        help="Report the latest position extrapolated to the newest frame's pts")
+    parser.add_argument("--params", type=load_params, default=HOUGH_PARAMS,
+                        help="Detector parameters saved by calibrate.py (default: built-in)")
     parser.add_argument("--verbose", "-v", action="count")
     args = parser.parse_args()
 
@@ -184,11 +465,18 @@ if __name__ == "__main__":
         logging.basicConfig(level=logging.DEBUG)
     else:
         logging.basicConfig(level=logging.INFO)
+    log_startup("imported")
+
+    if args.display:
+        # Open the window before the media stack loads: PyAV's bundled libraries break
+        # HighGUI when they are loaded first.
+        cv2.namedWindow("client")
 
     # run event loop
     loop = asyncio.get_event_loop()
     try:
-        loop.run_until_complete(run_answer())
+        loop.run_until_complete(run_answer(
+            args.host, args.port, args.display, args.extrapolate, args.params))
     except KeyboardInterrupt:
         pass
     finally:
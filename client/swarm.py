@@ -0,0 +1,310 @@
+"""
+Ball Bounce Client Swarm
+
+This module is a load generator for the Ball Bounce server. It opens N concurrent
+client sessions against one server, following the logic of `client.run_answer`, and
+reports how the server copes as N grows: the stream fps each session receives, the
+rate and latency at which the server scores the results, and the failure counts.
+
+Each session either uses a cheap stub detector, so that the load stays on the server,
+or the real Hough detector of the client. Sessions can also misbehave on the data
+channel by dropping, lagging or flooding their results.
+
+Attributes:
+    FAULTS (tuple): Names of the data channel faults a session can inject.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import random
+import time
+
+import aiortc
+import cv2
+import numpy as np
+from aiortc.contrib.signaling import TcpSocketSignaling
+from aiortc.mediastreams import MediaStreamError
+from av import VideoFrame
+
+try:
+    from client.client import (HOUGH_PARAMS, ResultReporter, consume_signaling, detect_ball,
+                               drain_results, load_params, start_detector, stop_detector,
+                               submit_frame)
+except ImportError: # Run as a script next to client.py, e.g. in the client image.
+    from client import (HOUGH_PARAMS, ResultReporter, consume_signaling, detect_ball,
+                        drain_results, load_params, start_detector, stop_detector,
+                        submit_frame)
+
+FAULTS = ("none", "drop", "lag", "flood")
+
+
+class SwarmStats():
+    """
+    Counters shared by all the sessions of one swarm stage.
+
+    Attributes:
+        frames (int): Video frames received from the server.
+        skipped (int): Frames skipped because the real detector could not keep up.
+        sent (int): Results sent on the data channels.
+        scored (int): Results the server replied with a score for.
+        errors (int): Results the server rejected, e.g. with an unknown pts.
+        latencies (list): Server-side scoring latencies in seconds.
+        mses (list): Mean squared errors reported by the server.
+        failures (dict): Failed sessions counted by the kind of their first failure
+            (connect, signaling, ice, stream, or timeout for a session cancelled by the
+            end of the stage before receiving any frame).
+    """
+    def __init__(self):
+        self.frames = 0
+        self.skipped = 0
+        self.sent = 0
+        self.scored = 0
+        self.errors = 0
+        self.latencies = []
+        self.mses = []
+        self.failures = dict()
+
+    def fail(self, kind: str):
+        """Counts one failed session of the given kind."""
+        self.failures[kind] = self.failures.get(kind, 0) + 1
+
+    def on_reply(self, message: str):
+        """Accounts a reply of the server to one of the results."""
+        reply = json.loads(message)
+        if 'error' in reply:
+            self.errors += 1
+            return
+        self.scored += 1
+        self.latencies.append(reply['latency'])
+        self.mses.append(reply['mse'])
+
+    def summary(self, sessions: int, duration: float) -> str:
+        """
+        Formats one report line of the stage.
+
+        Args:
+            sessions (int): Number of concurrent sessions of the stage.
+            duration (float): Length of the stage in seconds.
+
+        Returns:
+            str: The report line.
+        """
+        if self.latencies:
+            p50, p95 = np.percentile(self.latencies, [50, 95]) * 1000
+            mse = np.mean(self.mses)
+        else:
+            p50 = p95 = mse = float("nan")
+        failures = ",".join(f"{k}={v}" for k, v in sorted(self.failures.items())) or "-"
+        return (f"{sessions:>5} {self.frames / duration / sessions:>11.1f} "
+                f"{self.scored / duration:>9.1f} {p50:>8.1f} {p95:>8.1f} {mse:>10.1f} "
+                f"{self.errors:>7} {self.sent - self.scored - self.errors:>8} "
+                f"{self.skipped:>7} {failures}")
+
+    @staticmethod
+    def header() -> str:
+        """Formats the header matching `summary`."""
+        return (f"{'N':>5} {'stream fps':>11} {'scored/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+                f"{'mean MSE':>10} {'errors':>7} {'unscored':>8} {'skipped':>7} failures")
+
+
+def stub_position(frame: VideoFrame) -> tuple[int, int]:
+    """
+    Cheap stand-in for the detector that always reports the center of the frame.
+
+    Args:
+        frame (VideoFrame): The received video frame.
+
+    Returns:
+        tuple[int, int]: The center of the frame.
+    """
+    return frame.width // 2, frame.height // 2
+
+
+async def run_session(host: str, port: int, stats: SwarmStats, hough: bool=False,
+                      params: dict=HOUGH_PARAMS, extrapolate: bool=False, fault: str="none",
+                      drop_rate: float=0.5, lag: float=0.5, flood: int=5):
+    """
+    Runs one client session until it fails or is cancelled.
+
+    A failed session is counted once in `stats`, with the kind of its first failure.
+
+    Follows `client.run_answer` without the display: it answers the server's offer,
+    receives the video frames, detects the ball and sends the results.
+
+    Args:
+        host (str): Host of the server's signaling.
+        port (int): Port of the server's signaling.
+        stats (SwarmStats): Counters of the stage.
+        hough (bool, optional): Use the real detector in a separate process instead of
+            the stub. Defaults to False.
+        params (dict, optional): Parameters of cv2.HoughCircles for the real detector.
+        extrapolate (bool, optional): Report positions extrapolated to the newest pts,
+            see `client.ResultReporter`. Defaults to False.
+        fault (str, optional): One of `FAULTS`. Defaults to "none".
+        drop_rate (float, optional): Probability to drop a result with the "drop" fault.
+        lag (float, optional): Delay in seconds of the results with the "lag" fault.
+        flood (int, optional): Copies sent of each result with the "flood" fault.
+    """
+    signaling = TcpSocketSignaling(host, port)
+    pc = aiortc.RTCPeerConnection()
+    peer = dict()
+    detector = None
+    failure = None
+    # Kind of failure of an OSError once connected, by how far the session got.
+    phase = "signaling"
+    frames = 0
+
+    def fail(kind: str):
+        nonlocal failure
+        failure = failure or kind
+
+    @pc.on("datachannel")
+    def on_datachannel(channel: aiortc.RTCDataChannel):
+        channel.add_listener("message", stats.on_reply)
+        peer['channel'] = channel
+
+    @pc.on("track")
+    def on_track(track: aiortc.VideoStreamTrack):
+        peer['track'] = track
+
+    @pc.on("connectionstatechange")
+    async def on_connectionstatechange():
+        if pc.connectionState == "failed":
+            fail("ice")
+            await pc.close()
+
+    def send(data: str):
+        channel = peer.get('channel')
+        if channel is None or channel.readyState != "open":
+            return
+        stats.sent += 1
+        channel.send(data)
+
+    try:
+        await signaling.connect()
+        while 'track' not in peer:
+            if not await consume_signaling(pc, signaling):
+                fail("signaling")
+                return
+        phase = "stream"
+        if hough:
+            detector = start_detector(functools.partial(detect_ball, params=params))
+            _, frame_queue, result_queue = detector
+        reporter = ResultReporter(extrapolate)
+
+        while True:
+            frame = await peer['track'].recv()
+            frames += 1
+            stats.frames += 1
+            if hough:
+                cv_frame = cv2.cvtColor(frame.to_ndarray(), cv2.COLOR_YUV2BGR_I420)
+                stats.skipped += submit_frame(frame_queue, frame.pts, cv_frame)
+                results = drain_results(result_queue)
+            else:
+                results = [(frame.pts, *stub_position(frame), 0.0, 0.0)]
+
+            for message in reporter.report(results, frame):
+                data = json.dumps(message)
+                if fault == "drop" and random.random() < drop_rate:
+                    continue
+                elif fault == "lag":
+                    asyncio.get_running_loop().call_later(lag, send, data)
+                elif fault == "flood":
+                    for _ in range(flood):
+                        send(data)
+                else:
+                    send(data)
+    except OSError:
+        # TcpSocketSignaling only opens its connection on the first receive.
+        fail("connect" if signaling._writer is None else phase)
+    except MediaStreamError:
+        fail("stream")
+    except asyncio.CancelledError:
+        if frames == 0:
+            fail("timeout")
+        raise
+    finally:
+        if failure is not None:
+            stats.fail(failure)
+        if detector is not None:
+            stop_detector(*detector)
+        await pc.close()
+        await signaling.close()
+
+
+async def run_swarm(args: argparse.Namespace):
+    """
+    Runs one stage per entry of `args.sessions` and prints a report line for each.
+
+    Every stage opens its sessions concurrently, lets them run for `args.duration`
+    seconds and closes them before the next stage starts.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+    """
+    print(SwarmStats.header())
+    for n in args.sessions:
+        stats = SwarmStats()
+        n_hough = round(n * args.hough_ratio)
+        n_faulty = round(n * args.fault_ratio)
+        tasks = [
+            asyncio.create_task(run_session(
+                args.host, args.port, stats,
+                hough=i < n_hough, params=args.params, extrapolate=args.extrapolate,
+                fault=args.fault if i >= n - n_faulty else "none",
+                drop_rate=args.drop_rate, lag=args.lag, flood=args.flood,
+            ))
+            for i in range(n)
+        ]
+        start = time.monotonic()
+        _, pending = await asyncio.wait(tasks, timeout=args.duration)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        print(stats.summary(n, time.monotonic() - start), flush=True)
+        # Let the server tear the sessions down before the next stage.
+        await asyncio.sleep(args.cooldown)
+
+
+if __name__ == "__main__":
+    """
+    Parses command-line arguments and ramps up concurrent sessions against the server
+    to find its capacity limit.
+    """
+    parser = argparse.ArgumentParser(description="Ball bounce client swarm load generator")
+    parser.add_argument("--host", default="0.0.0.0", help="Host for HTTP server (default: 0.0.0.0)")
+    parser.add_argument("--port", type=int, default=8080, help="Port for HTTP server (default: 8080)")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                        help="Concurrent sessions of each stage (default: 1 2 4 8 16)")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per stage (default: 10)")
+    parser.add_argument("--cooldown", type=float, default=2, help="Seconds between stages (default: 2)")
+    parser.add_argument("--hough-ratio", type=float, default=0,
+                        help="Fraction of sessions running the real detector (default: 0, stub only)")
+    parser.add_argument("--params", type=load_params, default=HOUGH_PARAMS,
+                        help="Detector parameters saved by calibrate.py (default: built-in)")
+    parser.add_argument("--extrapolate", action="store_true",
+                        help="Report positions extrapolated to the newest frame's pts")
+    parser.add_argument("--fault", choices=FAULTS, default="none",
+                        help="Data channel fault injected by the faulty sessions (default: none)")
+    parser.add_argument("--fault-ratio", type=float, default=1,
+                        help="Fraction of sessions injecting the fault (default: 1)")
+    parser.add_argument("--drop-rate", type=float, default=0.5,
+                        help="Probability to drop a result with --fault drop (default: 0.5)")
+    parser.add_argument("--lag", type=float, default=0.5,
+                        help="Delay in seconds of the results with --fault lag (default: 0.5)")
+    parser.add_argument("--flood", type=int, default=5,
+                        help="Copies of each result sent with --fault flood (default: 5)")
+    parser.add_argument("--verbose", "-v", action="count")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.WARNING)
+
+    try:
+        asyncio.run(run_swarm(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,76 @@
+import asyncio
+import cv2
+import numpy as np
+import pytest
+
+from client.calibrate import *
+
+def ball_sample(x: int, y: int, r: int=20) -> tuple[np.ndarray, tuple[int, int]]:
+    """Creates a BGR frame with a white ball like BallBounce, with its center."""
+    frame = np.zeros((480, 960, 3), dtype='uint8')
+    cv2.circle(frame, center=(x, y), radius=r, color=(255, 255, 255), thickness=-1)
+    return frame, (x, y)
+
+def test_evaluate():
+    """
+    Test if evaluate measures the latency, the error and the detection ratio, counting
+    the miss penalty for the frames without a detected ball.
+    """
+    samples = [ball_sample(300, 200), (np.zeros((480, 960, 3), dtype='uint8'), (100, 100))]
+    params = {'dp': 1, 'minDist': 100, 'param1': 100, 'param2': 10, 'minRadius': 10, 'maxRadius': 40}
+    evaluation = evaluate(samples, params, miss_penalty=50)
+    assert evaluation['params'] == params
+    assert evaluation['latency_ms'] > 0
+    assert evaluation['detected'] == 0.5
+    assert 25 <= evaluation['error_px'] <= 27 # (~1 + 50) / 2
+
+def test_sweep():
+    """
+    Test if sweep evaluates every combination of the grid.
+    """
+    grid = {'dp': [1, 2], 'minDist': [100], 'param1': [100], 'param2': [10, 20], 'radius': [(10, 40)]}
+    evaluations = sweep([ball_sample(300, 200)], grid)
+    assert len(evaluations) == 4
+    assert {(e['params']['dp'], e['params']['param2']) for e in evaluations} == {(1, 10), (1, 20), (2, 10), (2, 20)}
+
+def test_pareto_front():
+    """
+    Test if pareto_front only keeps the evaluations more accurate than all faster ones.
+    """
+    evaluations = [
+        {'latency_ms': 1, 'error_px': 10},
+        {'latency_ms': 2, 'error_px': 12},
+        {'latency_ms': 3, 'error_px': 5},
+    ]
+    assert pareto_front(evaluations) == [evaluations[0], evaluations[2]]
+
+def test_select():
+    """
+    Test if select picks the most accurate evaluation within the target latency,
+    or the fastest one when none is within it, but never one that detected nothing.
+    """
+    evaluations = [
+        {'latency_ms': 1, 'error_px': 10, 'detected': 0.5},
+        {'latency_ms': 2, 'error_px': 5, 'detected': 0.8},
+        {'latency_ms': 3, 'error_px': 1, 'detected': 1.0},
+    ]
+    assert select(evaluations, 2.5) == evaluations[1]
+    assert select(evaluations, 0.5) == evaluations[0]
+
+    blind = {'latency_ms': 0.1, 'error_px': 50, 'detected': 0.0}
+    assert select([blind, *evaluations], 0.5) == evaluations[0]
+    assert select([blind, *evaluations], 2.5) == evaluations[1]
+    assert select([blind], 0.5) is None
+
+@pytest.mark.asyncio
+async def test_collect_timeout():
+    """
+    Test if collect gives up when the server sends nothing.
+    """
+    async def stall(reader, writer):
+        await reader.read()
+    listener = await asyncio.start_server(stall, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    with pytest.raises(TimeoutError):
+        await collect("127.0.0.1", port, 1, timeout=0.2)
+    listener.close()
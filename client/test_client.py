@@ -1,8 +1,34 @@
 from collections import defaultdict
+from fractions import Fraction
+from pathlib import Path
+import queue
+import subprocess
+import sys
 import pytest
 
+import aiortc
+from aiortc.contrib.signaling import BYE, TcpSocketSignaling
+from av import VideoFrame
 from client.client import *
 
+def test_import_is_light():
+    """
+    Test if importing the client leaves aiortc and av to be loaded later.
+    """
+    code = "import sys, client.client; assert not {'aiortc', 'av'} & set(sys.modules)"
+    subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parents[1], check=True)
+
+def test_load_aiortc_already_imported(caplog):
+    """
+    Test if load_aiortc does not log an import time when aiortc was already imported.
+    """
+    logger.addHandler(caplog.handler)
+    try:
+        assert load_aiortc.__wrapped__() is aiortc
+    finally:
+        logger.removeHandler(caplog.handler)
+    assert "media stack" not in caplog.text
+
 @pytest.mark.asyncio     
 async def test_consume_signaling_candidate():
     """
@@ -61,6 +87,118 @@ async def test_consume_signaling_wrong_type():
     response = await consume_signaling(mock_pc, mock_description_signaling)
     assert response == True
 
+def test_detect_ball():
+    """
+    Test if detect_ball locates a filled circle drawn on a black frame.
+    """
+    frame = np.zeros((480, 960, 3), dtype='uint8')
+    cv2.circle(frame, center=(300, 200), radius=40, color=(255, 255, 255), thickness=-1)
+    x, y = detect_ball(frame)
+    assert abs(x - 300) <= CV_DP and abs(y - 200) <= CV_DP
+
+def test_detect_ball_empty():
+    """
+    Test if detect_ball reports no ball on a black frame.
+    """
+    assert detect_ball(np.zeros((480, 960, 3), dtype='uint8')) is None
+
+def test_detect_ball_params():
+    """
+    Test if detect_ball uses the given parameters, e.g. to find a ball the default
+    ones miss.
+    """
+    frame = np.zeros((480, 960, 3), dtype='uint8')
+    cv2.circle(frame, center=(300, 200), radius=20, color=(255, 255, 255), thickness=-1)
+    params = {'dp': 1, 'minDist': 100, 'param1': 100, 'param2': 10, 'minRadius': 10, 'maxRadius': 40}
+    x, y = detect_ball(frame, params)
+    assert abs(x - 300) <= 1 and abs(y - 200) <= 1
+
+def test_load_params(tmp_path):
+    """
+    Test if load_params reads the parameters saved by the calibration and keeps
+    the defaults for the others.
+    """
+    path = tmp_path / "hough.json"
+    path.write_text(json.dumps({'params': {'dp': 2, 'param2': 20}, 'latency_ms': 3.0}))
+    assert load_params(path) == {'dp': 2, 'minDist': CV_MINDIST, 'param2': 20}
+
+def test_track_ball():
+    """
+    Test if track_ball reports nothing before the first detection, measures the
+    velocity between detections only, and predicts inside the frame on misses.
+    """
+    size = (960, 480)
+    detected, velocity, result = track_ball(None, (0.0, 0.0), 0, None, size)
+    assert result is None
+    detected, velocity, result = track_ball(detected, velocity, 3000, (100, 200), size)
+    assert result == (3000, 100, 200, 0.0, 0.0)
+    detected, velocity, result = track_ball(detected, velocity, 6000, (130, 170), size)
+    assert result == (6000, 130, 170, 0.01, -0.01)
+    # Misses are predicted from the last detection, without changing the velocity.
+    detected, velocity, result = track_ball(detected, velocity, 9000, None, size)
+    assert result == (9000, 160, 140, 0.01, -0.01)
+    detected, velocity, result = track_ball(detected, velocity, 12000, None, size)
+    assert result == (12000, 190, 110, 0.01, -0.01)
+    # A detection after misses measures the velocity from the last detection.
+    detected, velocity, result = track_ball(detected, velocity, 15000, (220, 80), size)
+    assert result == (15000, 220, 80, 0.01, -0.01)
+    # Predictions stay inside the frame.
+    _, _, result = track_ball(detected, velocity, 90000, None, size)
+    assert result[1:3] == (959, 0)
+
+def test_submit_frame():
+    """
+    Test if submit_frame skips the oldest frame instead of blocking when the
+    detector's queue is full.
+    """
+    frame_queue = queue.Queue(FRAME_QUEUE_SIZE)
+    frame = np.zeros((1, 1, 3), dtype='uint8')
+    skipped = [submit_frame(frame_queue, pts, frame) for pts in range(FRAME_QUEUE_SIZE + 1)]
+    assert skipped == [False] * FRAME_QUEUE_SIZE + [True]
+    assert [frame_queue.get_nowait()[0] for _ in range(FRAME_QUEUE_SIZE)] == list(range(1, FRAME_QUEUE_SIZE + 1))
+
+def test_drain_results():
+    """
+    Test if drain_results takes every pending result in order without waiting.
+    """
+    result_queue = queue.Queue()
+    result_queue.put((3000, 10, 20, 0.0, 0.0))
+    result_queue.put((6000, 12, 20, 0.0, 0.0))
+    assert [r[0] for r in drain_results(result_queue)] == [3000, 6000]
+    assert drain_results(result_queue) == []
+
+def test_ResultReporter_exact():
+    """
+    Test if every result is reported once with its own pts and its staleness
+    relative to the newest received frame.
+    """
+    reporter = ResultReporter()
+    results = [(3000, 10, 20, 0.0, 0.0), (6000, 12, 20, 0.0, 0.0)]
+    messages = reporter.report(results, mock_frame(9000))
+    assert [(m['pts'], m['x'], m['y']) for m in messages] == [(3000, 10, 20), (6000, 12, 20)]
+    assert [m['stale'] for m in messages] == [6000 / 90000, 3000 / 90000]
+    assert reporter.report([], mock_frame(12000)) == []
+
+def test_ResultReporter_extrapolate():
+    """
+    Test if the latest result is extrapolated to the pts of every received frame,
+    even without a new result, and kept inside the frame.
+    """
+    reporter = ResultReporter(extrapolate=True)
+    assert reporter.report([], mock_frame(0)) == []
+    # 0.001 pixel per pts unit, i.e. 3 pixels per frame at 30 fps
+    messages = reporter.report([(3000, 10, 20, 0.001, -0.001)], mock_frame(9000))
+    assert messages == [{'pts': 9000, 'x': 16, 'y': 14, 'stale': 6000 / 90000}]
+    messages = reporter.report([], mock_frame(30000))
+    assert (messages[0]['pts'], messages[0]['x'], messages[0]['y']) == (30000, 37, 0)
+
+def mock_frame(pts: int) -> VideoFrame:
+    """Creates an empty received frame with the given pts and a 90 kHz time base."""
+    frame = VideoFrame(width=960, height=480)
+    frame.pts = pts
+    frame.time_base = Fraction(1, 90000)
+    return frame
+
 class MockPC(aiortc.RTCPeerConnection):
     """
     Mock object for simulating the behavior of the RTCPeerConnection class.
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import math
+import pytest
+import socket
+import struct
+
+from av import VideoFrame
+from client.swarm import *
+
+def test_stub_position():
+    """
+    Test if the stub detector reports the center of the frame.
+    """
+    frame = VideoFrame(width=960, height=480)
+    assert stub_position(frame) == (480, 240)
+
+def test_SwarmStats_on_reply():
+    """
+    Test if SwarmStats accounts the scored results and the rejected ones separately.
+    """
+    stats = SwarmStats()
+    stats.on_reply(json.dumps({'pts': 0, 'mse': 4.0, 'latency': 0.05}))
+    stats.on_reply(json.dumps({'pts': 0, 'error': 'pts not found'}))
+    assert stats.scored == 1
+    assert stats.errors == 1
+    assert stats.latencies == [0.05]
+    assert stats.mses == [4.0]
+
+def test_SwarmStats_summary():
+    """
+    Test if the summary line reports the per-session stream fps, the scored rate and
+    the failures, and matches the header's columns.
+    """
+    stats = SwarmStats()
+    stats.frames, stats.sent = 60, 3
+    stats.on_reply(json.dumps({'pts': 0, 'mse': 4.0, 'latency': 0.05}))
+    stats.fail("connect")
+    stats.fail("connect")
+    fields = stats.summary(2, 1.0).split()
+    assert len(fields) == len(SwarmStats.header().split()) - 4 # multi-word column names
+    assert float(fields[1]) == 30.0 # stream fps per session
+    assert float(fields[2]) == 1.0 # scored/s
+    assert math.isclose(float(fields[3]), 50.0) # p50 ms
+    assert fields[7] == "2" # unscored
+    assert fields[8] == "0" # skipped
+    assert fields[9] == "connect=2"
+
+@pytest.mark.asyncio
+async def test_run_session_connect_failure():
+    """
+    Test if a session that cannot reach the server is counted once as a connect failure.
+    """
+    listener = await asyncio.start_server(lambda reader, writer: None, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    listener.close()
+    await listener.wait_closed()
+    stats = SwarmStats()
+    await run_session("127.0.0.1", port, stats)
+    assert stats.failures == {'connect': 1}
+
+@pytest.mark.asyncio
+async def test_run_session_signaling_reset():
+    """
+    Test if a session whose signaling connection is reset after connecting
+    is counted once as a signaling failure, not as a connect failure.
+    """
+    def reset(reader, writer):
+        sock = writer.get_extra_info("socket")
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        writer.transport.abort()
+    listener = await asyncio.start_server(reset, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    stats = SwarmStats()
+    await asyncio.wait_for(run_session("127.0.0.1", port, stats), 5)
+    listener.close()
+    assert stats.failures == {'signaling': 1}
+
+@pytest.mark.asyncio
+async def test_run_session_timeout():
+    """
+    Test if a session cancelled by the end of the stage before receiving any frame
+    is counted once as a timeout.
+    """
+    async def stall(reader, writer):
+        await reader.read()
+    listener = await asyncio.start_server(stall, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    stats = SwarmStats()
+    session = asyncio.create_task(run_session("127.0.0.1", port, stats))
+    await asyncio.sleep(0.2)
+    session.cancel()
+    await asyncio.gather(session, return_exceptions=True)
+    listener.close()
+    assert stats.failures == {'timeout': 1}
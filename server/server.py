@@ -7,147 +7,119 @@ and cv2 for image/frame manipulation. Clients can connect to this server to
 receive the ball's position and calculate the mean squared error of the ball's
 position based on their calculations.
 
+The media stack (aiortc, av and cv2, see `stream.py`) is only imported once the
+server is listening, in the background while it waits for its first client, and
+HighGUI is only touched with `--display`.
+
 Attributes:
     DATA_CHANNEL (str): Name of the WebRTC data channel used for communication.
+    PTS_TOLERANCE (int): Largest distance between a reported and a recorded pts that
+        still matches, half a frame interval of the 90 kHz video clock at 30 fps.
+    STARTED (float): Monotonic time at which the module started loading, before any
+        other import, the origin of the startup measurements.
     logger (logging.Logger): Logger instance for logging events and errors.
-    record (dict): Dictionary to store ball positions based on timestamps.
 """
+from __future__ import annotations
+
+import time
+
+STARTED = time.monotonic()
 
 import argparse
 import asyncio
+import bisect
+import functools
+import itertools
 import json
 import logging
-import cv2
-import random
-import numpy as np
+import os
+import sys
+from typing import TYPE_CHECKING
 
-"""
-HACK: It's necessary to run cv2.imshow once before importing VideoFrame and aiortc when deploying on dockers
-"""
-cv2.imshow("server", np.zeros((50, 50, 3)))
+import numpy as np
 
-import aiortc
-from av import VideoFrame
-from aiortc.contrib.signaling import BYE, TcpSocketSignaling
+if TYPE_CHECKING:
+    import aiortc
+    from aiortc.contrib.signaling import TcpSocketSignaling
 
 DATA_CHANNEL = "dev-demo"
+# PTS_TOLERANCE: aiortc's VP8 decoding rounds some pts down by one.
+PTS_TOLERANCE = 90000 // 30 // 2
 
 logger = logging.Logger("server")
-record = dict()
 
-class CircleFrame():
+startup_events = set()
+def log_startup(event: str):
     """
-    Represents a frame with drawable circles on a black background.
-    
-    This class provides utility methods to draw circles and convert the resulting
-    image to a video frame format suitable for video streaming or processing.
-    
-    Attributes:
-        w (int): Width of the frame.
-        h (int): Height of the frame.
-        rgb_array (np.ndarray): Array representing the RGB values of the frame.
+    Logs, once per process, how long after `STARTED` a startup event happened.
+
+    Args:
+        event (str): Name of the event, e.g. "listening" or "first frame scored".
     """
-    def __init__(self):
-        """
-        Initializes the CircleFrame with a default width, height, and a black background.
-        """
-        # Initialize the window size
-        self.w = 960
-        self.h = 480
-         # Black background supporting RGB
-        self.rgb_array: np.ndarray = np.zeros((self.h, self.w, 3), dtype='uint8')
-
-    def add_circle(self, x: int, y: int, r: int=20, 
-                   color=(255, 255, 255), thickness:int=(-1)) -> 'CircleFrame':
-        """
-        Draws a circle on the frame at the specified coordinates.
-
-        Args:
-            x (int): The x-coordinate of the circle's center.
-            y (int): The y-coordinate of the circle's center.
-            r (int, optional): The radius of the circle. Defaults to 20.
-            color (tuple, optional): The RGB color of the circle. Defaults to white.
-            thickness (int, optional): Thickness of the circle outline. A negative value
-                implies a filled circle. Defaults to -1 (filled circle).
-
-        Returns:
-            CircleFrame: The updated instance with the drawn circle.
-        """
-        cv2.circle(img=self.rgb_array, center=(x, y), 
-            radius=r, color=color, thickness=thickness)
-        return self
-
-    def to_video_frame(self) -> VideoFrame:
-        """
-        Converts the frame with drawn circles into a video frame format.
-
-        Returns:
-            VideoFrame: The frame in a format suitable for video processing or streaming.
-        """
-        return VideoFrame.from_ndarray(self.rgb_array)
-
-
-class BallBounce(aiortc.VideoStreamTrack):
+    if event in startup_events:
+        return
+    startup_events.add(event)
+    logger.warning(f"Startup: {event} after {(time.monotonic() - STARTED) * 1000:.0f} ms")
+
+
+@functools.cache
+def load_stream():
     """
-    A video stream track representing the ball's bouncing animation.
-    
-    This class simulates a ball bouncing within a 2D frame. The ball's movement is
-    determined by updating its x and y coordinates, and frames representing the
-    current position of the ball are generated.
-
-    Attributes:
-        frame (CircleFrame): The frame on which the ball's position is drawn.
-        radius (int): The radius of the ball.
-        x (int): The x-coordinate of the ball's center.
-        x_shift (int): The horizontal shift applied to the ball in each frame.
-        y (int): The y-coordinate of the ball's center.
-        y_shift (int): The vertical shift applied to the ball in each frame.
+    Imports `stream.py` and with it the media stack, the heaviest part of the startup.
+
+    The import time is only logged when this actually imports the media stack.
+
+    Returns:
+        module: The `stream` module.
+    """
+    loaded = 'aiortc' in sys.modules
+    start = time.monotonic()
+    if __package__:
+        from server import stream
+    else: # Run as a script next to stream.py, e.g. in the server image.
+        import stream
+    if not loaded:
+        logger.warning(f"Startup: media stack imported in {(time.monotonic() - start) * 1000:.0f} ms")
+    return stream
+
+
+def score_result(data: dict, record: dict, sent_at: dict) -> dict:
+    """
+    Score a ball position reported by the client against the recorded ground truth.
+
+    The reported pts is matched to the nearest recorded pts within `PTS_TOLERANCE`,
+    since the pts received by the client can differ slightly from the one sent.
+    Results arrive in pts order, so the matched pts and every older one are removed
+    from `record` and `sent_at`.
+
+    Args:
+        data (dict): The client's message with `pts`, `x` and `y`.
+        record (dict): Ball positions of the generated frames, keyed by increasing pts.
+        sent_at (dict): Monotonic time at which each frame was generated, keyed by pts.
+
+    Returns:
+        dict: The reply for the client, holding the `pts` with either the `mse` and the
+            scoring `latency` in seconds, or an `error` if the pts is unknown. Replies to
+            a `probe` also hold the recorded ball position `xy`.
     """
-    def __init__(self):
-        """
-        Initializes the BallBounce class with a default radius and random starting position.
-        """
-        super().__init__()
-        self.frame = CircleFrame()
-        # Initialize the 2D ball bouncing simulation or animation.
-        self.radius = 20
-        self.x = random.randint(self.radius, self.frame.w-self.radius)
-        self.x_shift = random.randint(1, self.frame.w//100)
-        self.y = random.randint(self.radius, self.frame.h-self.radius)
-        self.y_shift = random.randint(1, self.frame.h//100)
-
-    async def _ball_update(self):
-        """
-        Updates the ball's position based on its current position and shift values.
-        
-        The method adjusts the position of the ball considering its radius and the frame 
-        boundaries to ensure that it bounces back upon hitting the frame's edges.
-        """
-        if (self.x < self.radius) or self.x > (self.frame.w - self.radius):
-            self.x_shift *= -1
-        self.x += self.x_shift
-
-        if (self.y < self.radius) or self.y > (self.frame.h - self.radius):
-            self.y_shift *= -1
-        self.y += self.y_shift
-
-    async def recv(self) -> VideoFrame:
-        """
-        Generates and returns a frame showing the current position of the bouncing ball.
-        
-        The ball's position is updated, and then drawn on a fresh frame. Timestamp details 
-        are also added to the frame before it is returned.
-
-        Returns:
-            VideoFrame: The frame showing the ball's current position.
-        """
-        await self._ball_update()
-        frame = CircleFrame().add_circle(self.x, self.y, self.radius).to_video_frame()
-        pts,  time_base = await self.next_timestamp()
-        frame.pts = pts
-        frame.time_base = time_base
-        record[pts] = np.array([self.x, self.y])
-        return frame
+    pts = data['pts']
+    if pts not in record:
+        keys = list(record)
+        i = bisect.bisect_left(keys, pts)
+        pts = min(keys[max(i - 1, 0):i + 1], key=lambda p: abs(p - data['pts']), default=None)
+        if pts is None or abs(pts - data['pts']) > PTS_TOLERANCE:
+            return {'pts': data['pts'], 'error': 'pts not found'}
+    for old in itertools.takewhile(lambda p: p < pts, list(record)):
+        del record[old]
+        sent_at.pop(old, None)
+    # Mean Square Error (MSE)
+    record_xy = record.pop(pts)
+    err = np.mean((record_xy - np.array([data['x'], data['y']]))**2)
+    latency = time.monotonic() - sent_at.pop(pts, time.monotonic())
+    reply = {'pts': data['pts'], 'mse': float(err), 'latency': latency}
+    if data.get('probe'):
+        reply['xy'] = record_xy.tolist()
+    return reply
 
 
 async def consume_signaling(pc: aiortc.RTCPeerConnection, signaling: TcpSocketSignaling):
@@ -159,9 +131,16 @@ async def consume_signaling(pc: aiortc.RTCPeerConnection, signaling: TcpSocketSi
         signaling (TcpSocketSignaling): Signaling mechanism.
 
     Returns:
-        bool: False if the received object is a BYE signal, else True.
+        bool: False if the received object is a BYE signal or the connection is closed,
+            else True.
     """
+    import aiortc
+    from aiortc.contrib.signaling import BYE
+
     obj = await signaling.receive()
+    if obj is None:
+        # The client dropped the signaling connection.
+        return False
     if obj is BYE:
         await signaling.close()
         return False
@@ -180,20 +159,30 @@ async def on_shutdown():
     pcs.clear()
 
 
-async def run_offer():
+async def run_offer(signaling: TcpSocketSignaling, record: dict|None=None, display: bool=False):
     """
     Run the offer routine for the WebRTC communication.
 
     Establishes a peer connection, sends an offer to the client, receives and 
-    processes client's responses, and displays the calculated error.
+    processes client's responses, and displays the calculated error. Every scored
+    result is answered on the data channel so that clients can measure the server.
+
+    Args:
+        signaling (TcpSocketSignaling): Signaling connection to the client.
+        record (dict, optional): Where to store the ball positions of this session.
+            Defaults to the shared `stream.record`.
+        display (bool, optional): Show the scored positions in a HighGUI window.
+            Defaults to False.
     """
+    import aiortc
+    stream = load_stream()
+
     pc = aiortc.RTCPeerConnection()
     channel = pc.createDataChannel(DATA_CHANNEL)
-    pc.addTrack(BallBounce())
+    track = stream.BallBounce(stream.record if record is None else record)
+    pc.addTrack(track)
     pcs.add(pc)
 
-    signaling = TcpSocketSignaling(args.host, args.port)
-
     # send offer
     await pc.setLocalDescription(await pc.createOffer())
     await signaling.send(pc.localDescription)
@@ -202,20 +191,23 @@ async def run_offer():
         # Calculate error and display
         logger.info(f"{channel.label} - message received: {message}")
         data = json.loads(message)
-        global record
-        if data['pts'] not in record:
-            logger.error(f"{channel.label} - pts not found.")
-            print(record)
+        reply = score_result(data, track.record, track.sent_at)
+        if channel.readyState == "open":
+            channel.send(json.dumps(reply))
+        if 'error' in reply:
+            logger.error(f"{channel.label} - {reply['error']}.")
+            return
+        if data.get('probe'):
+            # Ground-truth request of client/calibrate.py, not a result to score.
             return
-        # Mean Square Error (MSE)
-        record_xy = record.pop(data['pts'])
-        err = np.mean((record_xy - np.array([data['x'], data['y']]))**2)
-        logger.warning(f"MSE={err}, between {(data['x'], data['y'])} and {record_xy}")
-        # Redness reflects the value of MSE.
-        color = [max(100, 255 - err)] * 2 + [255]
-        circle_frame = CircleFrame().add_circle(data['x'], data['y'], color=color)
-        cv2.imshow("server", circle_frame.rgb_array)
-        cv2.waitKey(2)
+        log_startup("first frame scored")
+        err = reply['mse']
+        stale = f", {data['stale'] * 1000:.0f} ms stale" if 'stale' in data else ""
+        logger.warning(f"MSE={err}, at {(data['x'], data['y'])}{stale}")
+        if display:
+            # Redness reflects the value of MSE.
+            color = [max(100, 255 - err)] * 2 + [255]
+            stream.CircleFrame().add_circle(data['x'], data['y'], color=color).show("server")
     channel.add_listener("message", on_message)
 
     @pc.on("connectionstatechange")
@@ -225,8 +217,41 @@ async def run_offer():
             await pc.close()
             pcs.discard(pc)
 
-    while True:
-        await consume_signaling(pc, signaling)
+    try:
+        while await consume_signaling(pc, signaling):
+            pass
+    finally:
+        await pc.close()
+        pcs.discard(pc)
+        # Release the client's socket, also when the client dropped it.
+        await signaling.close()
+
+
+async def serve(host: str, port: int, display: bool=False):
+    """
+    Accept clients on the signaling port and run one offer session per client.
+
+    Sessions run concurrently and each keeps its own record, so several clients
+    (e.g. `client/swarm.py`) can be scored by the same server. The media stack is
+    imported in a worker thread as soon as the server listens, so that the import
+    overlaps with waiting for the first client.
+
+    Args:
+        host (str): Host to listen on for signaling.
+        port (int): Port to listen on for signaling.
+        display (bool, optional): Show the scored positions in a HighGUI window.
+    """
+    preload = asyncio.create_task(asyncio.to_thread(load_stream))
+
+    async def on_connect(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        logger.info(f"Session from {writer.get_extra_info('peername')}")
+        stream = await preload
+        await run_offer(stream.AcceptedSignaling(reader, writer), dict(), display)
+
+    server = await asyncio.start_server(on_connect, host=host, port=port)
+    log_startup("listening")
+    async with server:
+        await server.serve_forever()
 
 
 if __name__ == "__main__":
@@ -234,6 +259,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ball bounce server demo")
     parser.add_argument("--host", default='0.0.0.0', help="Host for HTTP server (default: 0.0.0.0)")
     parser.add_argument("--port", type=int, default=8080, help="Port for HTTP server (default: 8080)")
+    parser.add_argument("--display", action=argparse.BooleanOptionalAction,
+                        default=bool(os.environ.get("DISPLAY")),
+                        help="Show the scored positions in a window (default: if $DISPLAY is set)")
     parser.add_argument("--verbose", "-v", action="count")
     args = parser.parse_args()
 
@@ -241,11 +269,18 @@ if __name__ == "__main__":
         logging.basicConfig(level=logging.DEBUG)
     else:
         logging.basicConfig(level=logging.INFO)
+    log_startup("imported")
+
+    if args.display:
+        import cv2
+        # Open the window before the media stack loads: PyAV's bundled libraries break
+        # HighGUI when they are loaded first.
+        cv2.namedWindow("server")
 
     # run event loop
     loop = asyncio.get_event_loop()
     try:
-        loop.run_until_complete(run_offer())
+        loop.run_until_complete(serve(args.host, args.port, args.display))
     except KeyboardInterrupt:
         pass
     finally:
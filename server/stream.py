@@ -0,0 +1,188 @@
+"""
+Ball Bounce Stream
+
+This module contains the media side of the Ball Bounce server: the frames of the
+bouncing ball, the video track streaming them over aiortc, and the signaling of the
+accepted clients. It imports aiortc and av, the heaviest part of the server's startup,
+so `server.py` only loads it once it is needed (see `server.load_stream`).
+
+Attributes:
+    RECORD_TTL (float): Seconds a generated frame is kept for scoring, so that the
+        frames a client never reports do not pile up.
+    record (dict): Dictionary to store ball positions based on timestamps.
+"""
+
+import asyncio
+import random
+import time
+import cv2
+import numpy as np
+
+import aiortc
+from av import VideoFrame
+from aiortc.contrib.signaling import TcpSocketSignaling
+
+RECORD_TTL = 10
+
+record = dict()
+
+class CircleFrame():
+    """
+    Represents a frame with drawable circles on a black background.
+    
+    This class provides utility methods to draw circles and convert the resulting
+    image to a video frame format suitable for video streaming or processing.
+    
+    Attributes:
+        w (int): Width of the frame.
+        h (int): Height of the frame.
+        rgb_array (np.ndarray): Array representing the RGB values of the frame.
+    """
+    def __init__(self):
+        """
+        Initializes the CircleFrame with a default width, height, and a black background.
+        """
+        # Initialize the window size
+        self.w = 960
+        self.h = 480
+         # Black background supporting RGB
+        self.rgb_array: np.ndarray = np.zeros((self.h, self.w, 3), dtype='uint8')
+
+    def add_circle(self, x: int, y: int, r: int=20, 
+                   color=(255, 255, 255), thickness:int=(-1)) -> 'CircleFrame':
+        """
+        Draws a circle on the frame at the specified coordinates.
+
+        Args:
+            x (int): The x-coordinate of the circle's center.
+            y (int): The y-coordinate of the circle's center.
+            r (int, optional): The radius of the circle. Defaults to 20.
+            color (tuple, optional): The RGB color of the circle. Defaults to white.
+            thickness (int, optional): Thickness of the circle outline. A negative value
+                implies a filled circle. Defaults to -1 (filled circle).
+
+        Returns:
+            CircleFrame: The updated instance with the drawn circle.
+        """
+        cv2.circle(img=self.rgb_array, center=(x, y), 
+            radius=r, color=color, thickness=thickness)
+        return self
+
+    def to_video_frame(self) -> VideoFrame:
+        """
+        Converts the frame with drawn circles into a video frame format.
+
+        Returns:
+            VideoFrame: The frame in a format suitable for video processing or streaming.
+        """
+        return VideoFrame.from_ndarray(self.rgb_array)
+
+    def show(self, name: str):
+        """
+        Displays the frame in the HighGUI window of the given name.
+
+        Args:
+            name (str): Name of the window.
+        """
+        cv2.imshow(name, self.rgb_array)
+        cv2.waitKey(2)
+
+
+class BallBounce(aiortc.VideoStreamTrack):
+    """
+    A video stream track representing the ball's bouncing animation.
+    
+    This class simulates a ball bouncing within a 2D frame. The ball's movement is
+    determined by updating its x and y coordinates, and frames representing the
+    current position of the ball are generated.
+
+    Attributes:
+        frame (CircleFrame): The frame on which the ball's position is drawn.
+        record (dict): Ball positions of the generated frames, keyed by pts.
+        sent_at (dict): Monotonic time at which each frame was generated, keyed by pts.
+        radius (int): The radius of the ball.
+        x (int): The x-coordinate of the ball's center.
+        x_shift (int): The horizontal shift applied to the ball in each frame.
+        y (int): The y-coordinate of the ball's center.
+        y_shift (int): The vertical shift applied to the ball in each frame.
+    """
+    def __init__(self, record: dict=record):
+        """
+        Initializes the BallBounce class with a default radius and random starting position.
+
+        Args:
+            record (dict, optional): Where to store the ball positions. Defaults to the
+                module-level `record`; concurrent sessions each pass their own.
+        """
+        super().__init__()
+        self.frame = CircleFrame()
+        self.record = record
+        self.sent_at = dict()
+        # Initialize the 2D ball bouncing simulation or animation.
+        self.radius = 20
+        self.x = random.randint(self.radius, self.frame.w-self.radius)
+        self.x_shift = random.randint(1, self.frame.w//100)
+        self.y = random.randint(self.radius, self.frame.h-self.radius)
+        self.y_shift = random.randint(1, self.frame.h//100)
+
+    async def _ball_update(self):
+        """
+        Updates the ball's position based on its current position and shift values.
+        
+        The method adjusts the position of the ball considering its radius and the frame 
+        boundaries to ensure that it bounces back upon hitting the frame's edges.
+        """
+        if (self.x < self.radius) or self.x > (self.frame.w - self.radius):
+            self.x_shift *= -1
+        self.x += self.x_shift
+
+        if (self.y < self.radius) or self.y > (self.frame.h - self.radius):
+            self.y_shift *= -1
+        self.y += self.y_shift
+
+    async def recv(self) -> VideoFrame:
+        """
+        Generates and returns a frame showing the current position of the bouncing ball.
+        
+        The ball's position is updated, and then drawn on a fresh frame. Timestamp details 
+        are also added to the frame before it is returned.
+
+        Returns:
+            VideoFrame: The frame showing the ball's current position.
+        """
+        await self._ball_update()
+        frame = CircleFrame().add_circle(self.x, self.y, self.radius).to_video_frame()
+        pts,  time_base = await self.next_timestamp()
+        frame.pts = pts
+        frame.time_base = time_base
+        self.record[pts] = np.array([self.x, self.y])
+        self.sent_at[pts] = time.monotonic()
+        self._expire(self.sent_at[pts] - RECORD_TTL)
+        return frame
+
+    def _expire(self, before: float):
+        """
+        Forgets the frames generated before the given time, oldest first.
+
+        Args:
+            before (float): Monotonic time.
+        """
+        while self.sent_at:
+            pts = next(iter(self.sent_at))
+            if self.sent_at[pts] >= before:
+                break
+            del self.sent_at[pts]
+            self.record.pop(pts, None)
+
+
+class AcceptedSignaling(TcpSocketSignaling):
+    """
+    TcpSocketSignaling bound to a client connection already accepted by `server.serve`.
+
+    `TcpSocketSignaling` only accepts a single client before it stops listening, so
+    `server.serve` owns the listening socket and hands each accepted connection to a session.
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        super().__init__(*writer.get_extra_info("sockname")[:2])
+        self._reader = reader
+        self._writer = writer
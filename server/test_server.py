@@ -1,9 +1,37 @@
 from collections import defaultdict
+from pathlib import Path
+import subprocess
+import sys
 import pytest
 import numpy as np
 
+import aiortc
+from aiortc.contrib.signaling import BYE, TcpSocketSignaling
 from av import VideoFrame
 from server.server import *
+from server.stream import *
+
+def test_import_is_light():
+    """
+    Test if importing the server leaves the media stack and HighGUI to be loaded later.
+    """
+    code = "import sys, server.server; assert not {'aiortc', 'av', 'cv2'} & set(sys.modules)"
+    subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parents[1], check=True)
+
+def test_load_stream():
+    """
+    Test if load_stream returns the stream module with the media classes.
+    """
+    assert load_stream().BallBounce is BallBounce
+
+def test_load_stream_not_shadowed():
+    """
+    Test if load_stream imports the package's stream module even when another
+    top-level `stream` module is importable.
+    """
+    code = ("import sys, types; sys.modules['stream'] = types.ModuleType('stream'); "
+            "import server.server; assert server.server.load_stream().__name__ == 'server.stream'")
+    subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parents[1], check=True)
 
 def test_CircleFrame():
     """
@@ -73,6 +101,71 @@ async def test_BallBounce_radius():
     assert video_frame.pts >= 0 # timestamp
     assert len(record) == 1 # Add another record row
 
+@pytest.mark.asyncio
+async def test_BallBounce_expire():
+    """
+    Test if a BallBounce object forgets the frames older than RECORD_TTL.
+    """
+    ball_bounce = BallBounce(dict())
+    first = await ball_bounce.recv()
+    ball_bounce.sent_at[first.pts] -= RECORD_TTL + 1
+    second = await ball_bounce.recv()
+    assert list(ball_bounce.record) == [second.pts]
+    assert list(ball_bounce.sent_at) == [second.pts]
+
+def test_score_result():
+    """
+    Test if score_result scores a known pts against the record, consumes it,
+    and reports the scoring latency.
+    """
+    record, sent_at = {3000: np.array([10, 20])}, {3000: 0.0}
+    reply = score_result({'pts': 3000, 'x': 12, 'y': 20}, record, sent_at)
+    assert reply['mse'] == 2
+    assert reply['latency'] > 0
+    assert 'xy' not in reply
+    assert len(record) == 0 and len(sent_at) == 0
+
+def test_score_result_probe():
+    """
+    Test if score_result replies to a probe with the recorded ball position.
+    """
+    record, sent_at = {3000: np.array([10, 20])}, {3000: 0.0}
+    reply = score_result({'pts': 3000, 'x': 0, 'y': 0, 'probe': True}, record, sent_at)
+    assert reply['xy'] == [10, 20]
+
+def test_score_result_rounded_pts():
+    """
+    Test if score_result matches a pts rounded down by the decoder to the recorded one,
+    and replies with the pts the client reported.
+    """
+    record, sent_at = {0: np.array([0, 0]), 3000: np.array([10, 20])}, {3000: 0.0}
+    reply = score_result({'pts': 2999, 'x': 10, 'y': 20}, record, sent_at)
+    assert reply['pts'] == 2999
+    assert reply['mse'] == 0
+    assert list(record) == []
+
+def test_score_result_prunes_older():
+    """
+    Test if score_result forgets the recorded pts older than the matched one,
+    which the client will not report anymore, and keeps the newer ones.
+    """
+    record = {pts: np.array([10, 20]) for pts in range(0, 30000, 3000)}
+    sent_at = {pts: 0.0 for pts in record}
+    score_result({'pts': 15000, 'x': 10, 'y': 20}, record, sent_at)
+    assert list(record) == list(sent_at) == list(range(18000, 30000, 3000))
+    reply = score_result({'pts': 6000, 'x': 10, 'y': 20}, record, sent_at)
+    assert reply == {'pts': 6000, 'error': 'pts not found'}
+
+def test_score_result_unknown_pts():
+    """
+    Test if score_result replies with an error for a pts that is not in the record.
+    """
+    reply = score_result({'pts': 3000, 'x': 12, 'y': 20}, dict(), dict())
+    assert reply == {'pts': 3000, 'error': 'pts not found'}
+    # More than half a frame interval away
+    reply = score_result({'pts': 3000, 'x': 12, 'y': 20}, {6000: np.array([10, 20])}, dict())
+    assert reply == {'pts': 3000, 'error': 'pts not found'}
+
 @pytest.mark.asyncio     
 async def test_consume_signaling_exit():
     """
@@ -111,6 +204,17 @@ async def test_consume_signaling_candidate():
     response = await consume_signaling(mock_pc, mock_candidate_signaling)
     assert response == True
 
+@pytest.mark.asyncio     
+async def test_consume_signaling_closed():
+    """
+    Test if consume_signaling function ends the session when the client
+    dropped the signaling connection.
+    """
+    mock_pc = MockPC()
+    mock_closed_signaling = MockTCPSignaling({'receive': None})
+    response = await consume_signaling(mock_pc, mock_closed_signaling)
+    assert response == False
+
 @pytest.mark.asyncio
 async def test_on_shutdown():
     """